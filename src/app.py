@@ -1,5 +1,8 @@
+import re
 from pathlib import Path
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import streamlit as st
 
 BASE_DIR = Path(__file__).resolve().parents[1]
@@ -7,12 +10,17 @@ OUT_DIR = BASE_DIR / "output"
 
 ACCOUNTS_CSV = OUT_DIR / "accounts_all.csv"
 TXNS_CSV = OUT_DIR / "transactions_all.csv"
+ACCOUNTS_PARQUET = OUT_DIR / "accounts_all.parquet"
+TXNS_PARQUET = OUT_DIR / "transactions_all.parquet"
+
+# Same order as the old sequential replaces: UPI prefix, then POS prefix, then card tail
+_MERCH_RE = re.compile(r"^(?:UPI/[^/]+/)?(?:POS/[^/]+/)?|/CARD.*$")
 
 st.set_page_config(page_title="Axis Statement Analytics", layout="wide")
 st.title("Axis Bank Statement Analytics (Sample Batch)")
 
 st.caption(
-    "Pipeline: PDF extraction (pdfplumber) → Cleaning & standardization → CSV/DB storage → Analytics dashboard (Streamlit). "
+    "Pipeline: PDF extraction (PyMuPDF / pdfplumber) → Cleaning & standardization → CSV/DB storage → Analytics dashboard (Streamlit). "
     "Validated on a 100-statement batch; designed to scale to 1000+ statements."
 )
 
@@ -21,13 +29,48 @@ if not ACCOUNTS_CSV.exists() or not TXNS_CSV.exists():
     st.error("CSV outputs not found. Run extraction first to create output/accounts_all.csv and output/transactions_all.csv")
     st.stop()
 
-@st.cache_data
-def load_data():
-    accounts = pd.read_csv(ACCOUNTS_CSV, dtype={"account_number": "string", "customer_id": "string"})
-    txns = pd.read_csv(TXNS_CSV, dtype={"account_number": "string"})
-    return accounts, txns
-
-accounts, txns = load_data()
+def read_csv_arrow(path: Path, string_cols: list) -> pd.DataFrame:
+    # pyarrow's multithreaded reader; ID columns are typed up front so leading zeros survive
+    opts = pacsv.ConvertOptions(
+        column_types={c: pa.string() for c in string_cols},
+        strings_can_be_null=True,
+    )
+    df = pacsv.read_csv(path, convert_options=opts).to_pandas()
+    return df.astype({c: "string" for c in string_cols if c in df.columns})
+
+def index_by_account(df: pd.DataFrame) -> pd.DataFrame:
+    # Sorted account index turns each selection into a binary search instead of a full scan
+    df = df.set_index(df["account_number"].fillna("").rename(None))
+    return df.sort_index(kind="stable")
+
+def data_version() -> tuple:
+    # Output file mtimes: cheap cache keys that only change when extraction is re-run
+    paths = [ACCOUNTS_CSV, TXNS_CSV, ACCOUNTS_PARQUET, TXNS_PARQUET]
+    return tuple(p.stat().st_mtime if p.exists() else 0.0 for p in paths)
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def load_data(version: tuple):
+    # Prefer the typed Parquet outputs, but only if they are from the same (or a later) run as the CSVs
+    accts_csv_mtime, txns_csv_mtime, accts_pq_mtime, txns_pq_mtime = version
+    if accts_pq_mtime >= accts_csv_mtime and txns_pq_mtime >= txns_csv_mtime:
+        accounts = pd.read_parquet(ACCOUNTS_PARQUET)
+        txns = pd.read_parquet(TXNS_PARQUET)
+    else:
+        accounts = read_csv_arrow(ACCOUNTS_CSV, ["account_number", "customer_id"])
+        txns = read_csv_arrow(TXNS_CSV, ["account_number"])
+        txns["txn_date"] = pd.to_datetime(txns["txn_date"], errors="coerce", dayfirst=True)
+    accounts = accounts.astype({"account_number": "string", "customer_id": "string"})
+    # Categorical dtypes let the groupbys below aggregate on integer codes
+    dtypes = {"account_number": "string", "category": "category", "month": "category"}
+    txns = txns.astype({c: t for c, t in dtypes.items() if c in txns.columns})
+    return index_by_account(accounts), index_by_account(txns)
+
+version = data_version()
+accounts, txns = load_data(version)
+
+if "category" not in txns.columns or "month" not in txns.columns:
+    st.error("Outputs predate the category/month columns. Re-run extraction (python src/extract_batch.py) to rebuild them.")
+    st.stop()
 
 # ---- Sidebar Filters ----
 st.sidebar.header("Filters")
@@ -37,67 +80,64 @@ acct_list = sorted([a for a in acct_list if a and a.strip() != ""])
 
 selected_acct = st.sidebar.selectbox("Select Account Number", acct_list)
 
-cust_acc = accounts[accounts["account_number"] == selected_acct].head(1)
-cust_txn = txns[txns["account_number"] == selected_acct].copy()
-
-# Convert date
-cust_txn["txn_date"] = pd.to_datetime(cust_txn["txn_date"], errors="coerce", dayfirst=True)
-cust_txn = cust_txn.dropna(subset=["txn_date"])
-
-# ---- Simple categorization (keyword based) ----
-def categorize(narr: str) -> str:
-    n = str(narr).upper()
-    if "UPI" in n:
-        return "UPI"
-    if "POS" in n or "CARD" in n:
-        return "Card/POS"
-    if "ATM" in n:
-        return "ATM"
-    if "NEFT" in n:
-        return "NEFT"
-    if "IMPS" in n:
-        return "IMPS"
-    if "ACH" in n or "ECS" in n:
-        return "ACH/ECS"
-    if "SALARY" in n:
-        return "Salary"
-    if "RENT" in n:
-        return "Rent"
-    if any(x in n for x in ["HOTSTAR", "NETFLIX", "PRIME", "SPOTIFY"]):
-        return "Subscriptions"
-    if any(x in n for x in ["SWIGGY", "ZOMATO", "EATSURE"]):
-        return "Food Delivery"
-    if any(x in n for x in ["AMAZON", "FLIPKART", "MYNTRA", "MEESHO"]):
-        return "Shopping"
-    return "Others"
-
-cust_txn["category"] = cust_txn["narration"].apply(categorize)
-
-# Month column
-cust_txn["month"] = cust_txn["txn_date"].dt.to_period("M").astype(str)
-
-# Sort
-cust_txn_sorted = cust_txn.sort_values("txn_date", ascending=False)
+# ---- Per-account view (cached, so revisiting an account skips the rework) ----
+@st.cache_data(show_spinner=False, max_entries=256)
+def get_account_view(acct: str, version: tuple) -> dict:
+    cust_txn = txns.loc[acct:acct]
+    cust_txn = cust_txn.dropna(subset=["txn_date"])
+
+    txn_sorted = cust_txn.sort_values("txn_date", ascending=False)
+
+    total_debit = cust_txn["debit"].fillna(0).sum() if "debit" in cust_txn.columns else 0
+    total_credit = cust_txn["credit"].fillna(0).sum() if "credit" in cust_txn.columns else 0
+
+    latest_balance = txn_sorted["balance"].dropna().head(1)
+    latest_balance_val = float(latest_balance.iloc[0]) if len(latest_balance) else None
+
+    large_debits = cust_txn[cust_txn["debit"].fillna(0) >= 10000].sort_values("debit", ascending=False).head(10)
+
+    monthly = cust_txn.groupby("month", as_index=False, observed=True)[["debit", "credit"]].sum()
+    monthly = monthly.sort_values("month")
+
+    cat = cust_txn.groupby("category", as_index=False, observed=True)["debit"].sum()
+    cat = cat.sort_values("debit", ascending=False).head(10)
+
+    # Strip UPI/xxxxxx/ and POS/xxxxxx/ prefixes and card tails like /CARD **1234 in one pass
+    merchant = cust_txn["narration"].astype(str).str.upper().str.replace(_MERCH_RE, "", regex=True).str.strip()
+
+    top_merchants = cust_txn.assign(merchant=merchant).groupby("merchant", as_index=False)["debit"].sum()
+    top_merchants = top_merchants.sort_values("debit", ascending=False).head(10)
+
+    return {
+        # Drop the account-number index so tables don't show the account twice
+        "cust_acc": accounts.loc[acct:acct].head(1).reset_index(drop=True),
+        "txn_sorted": txn_sorted.reset_index(drop=True),
+        "kpis": (total_debit, total_credit, len(cust_txn), total_credit - total_debit),
+        "latest_balance": latest_balance_val,
+        "large_debits": large_debits.reset_index(drop=True),
+        "monthly": monthly,
+        "cat": cat,
+        "top_merchants": top_merchants,
+    }
+
+view = get_account_view(selected_acct, version)
 
 # ---- Layout ----
 col1, col2 = st.columns([1, 2])
 
 with col1:
     st.subheader("Account Summary")
-    st.dataframe(cust_acc, use_container_width=True)
+    st.dataframe(view["cust_acc"], use_container_width=True)
 
 with col2:
     st.subheader("Transactions (Latest 50)")
-    st.dataframe(cust_txn_sorted.head(50), use_container_width=True)
+    st.dataframe(view["txn_sorted"].head(50), use_container_width=True)
 
 # ---- KPIs ----
 st.subheader("KPIs (Selected Account)")
 k1, k2, k3, k4 = st.columns(4)
 
-total_debit = cust_txn["debit"].fillna(0).sum() if "debit" in cust_txn.columns else 0
-total_credit = cust_txn["credit"].fillna(0).sum() if "credit" in cust_txn.columns else 0
-txn_count = len(cust_txn)
-net_flow = total_credit - total_debit
+total_debit, total_credit, txn_count, net_flow = view["kpis"]
 
 k1.metric("Total Debit", f"{total_debit:,.2f}")
 k2.metric("Total Credit", f"{total_credit:,.2f}")
@@ -107,10 +147,8 @@ k4.metric("Net Cashflow", f"{net_flow:,.2f}")
 # ---- Alerts ----
 st.subheader("Alerts")
 
-latest_balance = cust_txn_sorted["balance"].dropna().head(1)
-latest_balance_val = float(latest_balance.iloc[0]) if len(latest_balance) else None
-
-large_debits = cust_txn[cust_txn["debit"].fillna(0) >= 10000].sort_values("debit", ascending=False).head(10)
+latest_balance_val = view["latest_balance"]
+large_debits = view["large_debits"]
 
 if latest_balance_val is not None and latest_balance_val < 5000:
     st.warning(f"Low balance alert: Latest balance is {latest_balance_val:,.2f}")
@@ -129,33 +167,16 @@ c1, c2 = st.columns(2)
 
 with c1:
     st.markdown("**Monthly Debit vs Credit**")
-    monthly = cust_txn.groupby("month", as_index=False)[["debit", "credit"]].sum()
-    monthly = monthly.sort_values("month")
-    st.line_chart(monthly.set_index("month")[["debit", "credit"]])
+    st.line_chart(view["monthly"].set_index("month")[["debit", "credit"]])
 
 with c2:
     st.markdown("**Category-wise Debit (Top 10)**")
-    cat = cust_txn.groupby("category", as_index=False)["debit"].sum()
-    cat = cat.sort_values("debit", ascending=False).head(10)
-    st.bar_chart(cat.set_index("category")["debit"])
+    st.bar_chart(view["cat"].set_index("category")["debit"])
 
 # ---- Top Merchants ----
 st.subheader("Top Merchants / Payees (by Debit)")
 
-merchant = cust_txn.copy()
-merchant["merchant"] = merchant["narration"].astype(str).str.upper()
-
-# Extract merchant strings after UPI/xxxxxx/ and POS/xxxxxx/
-merchant["merchant"] = merchant["merchant"].str.replace(r"^UPI/[^/]+/", "", regex=True)
-merchant["merchant"] = merchant["merchant"].str.replace(r"^POS/[^/]+/", "", regex=True)
-
-# Remove card tail like /CARD **1234
-merchant["merchant"] = merchant["merchant"].str.replace(r"/CARD.*$", "", regex=True).str.strip()
-
-top_merchants = merchant.groupby("merchant", as_index=False)["debit"].sum()
-top_merchants = top_merchants.sort_values("debit", ascending=False).head(10)
-
-st.bar_chart(top_merchants.set_index("merchant")["debit"])
+st.bar_chart(view["top_merchants"].set_index("merchant")["debit"])
 
 # ---- Management View ----
 st.subheader("Management View (All Accounts in Batch)")
@@ -177,5 +198,11 @@ if "branch" in accounts.columns:
 
 st.divider()
 st.subheader("Downloads")
-st.download_button("Download accounts_all.csv", data=ACCOUNTS_CSV.read_bytes(), file_name="accounts_all.csv")
-st.download_button("Download transactions_all.csv", data=TXNS_CSV.read_bytes(), file_name="transactions_all.csv")
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def read_bytes(path: str, mtime: float) -> bytes:
+    # mtime only keys the cache: bytes are read once per extraction run, not on every rerun
+    return Path(path).read_bytes()
+
+st.download_button("Download accounts_all.csv", data=read_bytes(str(ACCOUNTS_CSV), ACCOUNTS_CSV.stat().st_mtime), file_name="accounts_all.csv")
+st.download_button("Download transactions_all.csv", data=read_bytes(str(TXNS_CSV), TXNS_CSV.stat().st_mtime), file_name="transactions_all.csv")
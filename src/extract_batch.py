@@ -1,5 +1,12 @@
+import atexit
+import os
 import re
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
+import fitz  # PyMuPDF
+import numpy as np
 import pandas as pd
 import pdfplumber
 from datetime import datetime
@@ -10,64 +17,92 @@ OUT_DIR = BASE_DIR / "output"
 OUT_DIR.mkdir(parents=True, exist_ok=True)
 
 LOG_FILE = OUT_DIR / "run_log.txt"
+_LOG_FH = None  # opened once per run in main()
+
+_ACCT_RE = re.compile(r"Account\s+Number\s*[:\-]?\s*(\d+)", re.IGNORECASE)
+_HOLDER_RE = re.compile(r"Account\s+Holder\s+Name\s*[:\-]?\s*(.+)", re.IGNORECASE)
+_CIF_RE = re.compile(r"(Customer\s*ID|CIF)\s*[:\-]?\s*(\d+)", re.IGNORECASE)
+_IFSC_RE = re.compile(r"IFSC\s+Code\s*[:\-]?\s*([A-Z0-9]+)", re.IGNORECASE)
+_BRANCH_RE = re.compile(r"Branch\s*[:\-]?\s*(.+)", re.IGNORECASE)
+_PERIOD_RE = re.compile(
+    r"Statement\s+Period\s*[:\-]?\s*([0-9A-Za-z\-]+)\s*to\s*([0-9A-Za-z\-]+)",
+    re.IGNORECASE,
+)
+_NONNUM_RE = re.compile(r"[^\d\.\-]")
+_SPACES_RE = re.compile(r"\s+")
+
+ACCOUNT_COLUMNS = ["pdf_file", "account_number", "holder_name", "customer_id", "ifsc_code", "branch", "period_from", "period_to"]
+TXN_COLUMNS = ["txn_date", "narration", "reference", "dr_cr", "debit", "credit", "balance"]
 
 
 def log(msg: str):
     stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     line = f"[{stamp}] {msg}"
     print(line, flush=True)
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(line + "\n")
-
-
-def grab1(pattern: str, text: str):
-    m = re.search(pattern, text, re.IGNORECASE)
+    if _LOG_FH is not None:
+        _LOG_FH.write(line + "\n")
+
+# Keyword based narration categories, first match wins
+CATEGORY_RULES = [
+    ("UPI", "UPI"),
+    ("Card/POS", "POS|CARD"),
+    ("ATM", "ATM"),
+    ("NEFT", "NEFT"),
+    ("IMPS", "IMPS"),
+    ("ACH/ECS", "ACH|ECS"),
+    ("Salary", "SALARY"),
+    ("Rent", "RENT"),
+    ("Subscriptions", "HOTSTAR|NETFLIX|PRIME|SPOTIFY"),
+    ("Food Delivery", "SWIGGY|ZOMATO|EATSURE"),
+    ("Shopping", "AMAZON|FLIPKART|MYNTRA|MEESHO"),
+]
+
+
+def grab1(rx: re.Pattern, text: str):
+    m = rx.search(text)
     return m.group(1).strip() if m else None
 
 
-def grab_last_number(pattern: str, text: str):
-    m = re.search(pattern, text, re.IGNORECASE)
+def grab_last_number(rx: re.Pattern, text: str):
+    m = rx.search(text)
     if not m:
         return None
     return m.groups()[-1].strip()
 
 
-def clean_amount(x):
-    if x is None:
-        return None
-    x = str(x).strip()
-    if not x or x.lower() in {"na", "nan", "-"}:
-        return None
-    x = x.replace(",", "")
-    x = re.sub(r"[^\d\.\-]", "", x)
-    if x in {"", "-", "."}:
-        return None
-    try:
-        return float(x)
-    except ValueError:
-        return None
+def clean_amounts(s: pd.Series) -> pd.Series:
+    s = s.astype("string").str.replace(",", "", regex=False).str.replace(_NONNUM_RE, "", regex=True)
+    return pd.to_numeric(s, errors="coerce").astype("float64")
+
+
+def categorize(narration: pd.Series) -> np.ndarray:
+    n = narration.astype("string").str.upper()
+    conds = [n.str.contains(pat, regex=True, na=False).to_numpy(dtype=bool) for _, pat in CATEGORY_RULES]
+    choices = [name for name, _ in CATEGORY_RULES]
+    return np.select(conds, choices, default="Others")
 
 
 def extract_account_info(pdf_path: Path) -> dict:
-    text = ""
-    with pdfplumber.open(str(pdf_path)) as pdf:
-        for page in pdf.pages[:2]:
-            text += "\n" + (page.extract_text() or "")
+    # Only the first two pages carry the header; fall back to pdfplumber if PyMuPDF gets no text
+    try:
+        with fitz.open(str(pdf_path)) as doc:
+            text = "\n".join(doc[i].get_text("text", sort=True) for i in range(min(2, doc.page_count)))
+    except Exception:
+        text = ""
+    if not text.strip():
+        with pdfplumber.open(str(pdf_path), pages=[1, 2]) as pdf:
+            text = "\n".join((p.extract_text() or "") for p in pdf.pages)
 
     info = {
         "pdf_file": pdf_path.name,
-        "account_number": grab1(r"Account\s+Number\s*[:\-]?\s*(\d+)", text),
-        "holder_name": grab1(r"Account\s+Holder\s+Name\s*[:\-]?\s*(.+)", text),
-        "customer_id": grab_last_number(r"(Customer\s*ID|CIF)\s*[:\-]?\s*(\d+)", text),
-        "ifsc_code": grab1(r"IFSC\s+Code\s*[:\-]?\s*([A-Z0-9]+)", text),
-        "branch": grab1(r"Branch\s*[:\-]?\s*(.+)", text),
+        "account_number": grab1(_ACCT_RE, text),
+        "holder_name": grab1(_HOLDER_RE, text),
+        "customer_id": grab_last_number(_CIF_RE, text),
+        "ifsc_code": grab1(_IFSC_RE, text),
+        "branch": grab1(_BRANCH_RE, text),
     }
 
-    m = re.search(
-        r"Statement\s+Period\s*[:\-]?\s*([0-9A-Za-z\-]+)\s*to\s*([0-9A-Za-z\-]+)",
-        text,
-        re.IGNORECASE,
-    )
+    m = _PERIOD_RE.search(text)
     info["period_from"] = m.group(1).strip() if m else None
     info["period_to"] = m.group(2).strip() if m else None
 
@@ -79,69 +114,96 @@ def extract_account_info(pdf_path: Path) -> dict:
     return info
 
 
-def extract_transactions(pdf_path: Path) -> pd.DataFrame:
-    all_rows = []
+def iter_tables_fitz(pdf_path: Path):
+    with fitz.open(str(pdf_path)) as doc:
+        for page in doc:
+            for tbl in page.find_tables().tables:
+                yield tbl.extract()
+
+
+def iter_tables_pdfplumber(pdf_path: Path):
     with pdfplumber.open(str(pdf_path)) as pdf:
         for page in pdf.pages:
             tables = page.extract_tables() or []
-            for tbl in tables:
-                if not tbl or len(tbl) < 2:
-                    continue
-
-                header_idx = None
-                for i, row in enumerate(tbl[:5]):
-                    joined = " ".join([str(c or "") for c in row]).lower()
-                    if ("date" in joined and "narration" in joined and "balance" in joined):
-                        header_idx = i
-                        break
-                if header_idx is None:
-                    continue
-
-                headers = [str(h or "").strip().lower() for h in tbl[header_idx]]
-                headers = [re.sub(r"\s+", " ", h).replace("transaction type", "type") for h in headers]
-
-                for row in tbl[header_idx + 1:]:
-                    if not row or all((c is None or str(c).strip() == "") for c in row):
-                        continue
-                    rec = {}
-                    for j in range(max(len(headers), len(row))):
-                        key = headers[j] if j < len(headers) else f"col{j}"
-                        val = row[j] if j < len(row) else None
-                        rec[key] = val
-                    all_rows.append(rec)
-
-    df = pd.DataFrame(all_rows)
+            # pdfplumber keeps each page's chars/lines cached; drop them so peak memory is one page
+            page.flush_cache()
+            if hasattr(page.get_textmap, "cache_clear"):
+                page.get_textmap.cache_clear()
+            yield from tables
+
+
+def canonical_column(header: str):
+    if header.startswith("date"):
+        return "txn_date"
+    if "narration" in header or "description" in header:
+        return "narration"
+    if "reference" in header or header == "ref":
+        return "reference"
+    if "type" in header:
+        return "dr_cr"
+    if "debit" in header:
+        return "debit"
+    if "credit" in header:
+        return "credit"
+    if "balance" in header:
+        return "balance"
+    return None
+
+
+def collect_columns(tables) -> dict:
+    # Column-wise accumulation: every row appends to every list, so lengths stay aligned
+    cols = {c: [] for c in TXN_COLUMNS}
+    seen = set()
+    for tbl in tables:
+        if not tbl or len(tbl) < 2:
+            continue
+
+        header_idx = None
+        for i, row in enumerate(tbl[:5]):
+            joined = " ".join([str(c or "") for c in row]).lower()
+            if ("date" in joined and "narration" in joined and "balance" in joined):
+                header_idx = i
+                break
+        if header_idx is None:
+            continue
+
+        headers = [str(h or "").strip().lower() for h in tbl[header_idx]]
+        headers = [_SPACES_RE.sub(" ", h).replace("transaction type", "type") for h in headers]
+
+        # canonical column -> position in this table (first matching header wins)
+        positions = {}
+        for j, h in enumerate(headers):
+            name = canonical_column(h)
+            if name and name not in positions:
+                positions[name] = j
+
+        for row in tbl[header_idx + 1:]:
+            if not row or all((c is None or str(c).strip() == "") for c in row):
+                continue
+            for name, values in cols.items():
+                j = positions.get(name)
+                values.append(row[j] if j is not None and j < len(row) else None)
+            seen.update(positions)
+
+    return {c: cols[c] for c in TXN_COLUMNS if c in seen}
+
+
+def extract_transactions(pdf_path: Path) -> pd.DataFrame:
+    # PyMuPDF is much faster; fall back to pdfplumber if it finds no usable table
+    try:
+        cols = collect_columns(iter_tables_fitz(pdf_path))
+    except Exception:
+        cols = {}
+    if not cols:
+        cols = collect_columns(iter_tables_pdfplumber(pdf_path))
+
+    df = pd.DataFrame(cols)
     if df.empty:
         return df
 
-    rename_map = {}
-    for c in df.columns:
-        cl = c.lower()
-        if cl.startswith("date"):
-            rename_map[c] = "txn_date"
-        elif "narration" in cl or "description" in cl:
-            rename_map[c] = "narration"
-        elif "reference" in cl or cl == "ref":
-            rename_map[c] = "reference"
-        elif "type" in cl:
-            rename_map[c] = "dr_cr"
-        elif "debit" in cl:
-            rename_map[c] = "debit"
-        elif "credit" in cl:
-            rename_map[c] = "credit"
-        elif "balance" in cl:
-            rename_map[c] = "balance"
-
-    df = df.rename(columns=rename_map)
-    keep = [c for c in ["txn_date", "narration", "reference", "dr_cr", "debit", "credit", "balance"] if c in df.columns]
-    df = df[keep].copy()
-
-    if "debit" in df.columns:
-        df["debit"] = df["debit"].apply(clean_amount)
-    if "credit" in df.columns:
-        df["credit"] = df["credit"].apply(clean_amount)
-    if "balance" in df.columns:
-        df["balance"] = df["balance"].apply(clean_amount)
+    for c in ["debit", "credit", "balance"]:
+        if c in df.columns:
+            df[c] = clean_amounts(df[c])
 
     for c in ["txn_date", "narration", "reference", "dr_cr"]:
         if c in df.columns:
@@ -150,9 +212,60 @@ def extract_transactions(pdf_path: Path) -> pd.DataFrame:
     return df
 
 
+def process_one(pdf_path: Path) -> tuple[dict | None, pd.DataFrame | None, dict | None]:
+    """Parse one PDF. Runs in a worker process, so it must not log or write files."""
+    acc = None
+    try:
+        acc = extract_account_info(pdf_path)
+
+        txns = extract_transactions(pdf_path)
+        if not txns.empty:
+            txns.insert(0, "pdf_file", pdf_path.name)
+            txns.insert(1, "account_number", acc.get("account_number"))
+
+        return acc, txns, None
+
+    except Exception as e:
+        return acc, None, {"pdf_file": pdf_path.name, "error": str(e)}
+
+
+def process_isolated(pdf_path: Path) -> tuple[dict | None, pd.DataFrame | None, dict | None]:
+    """Run process_one in its own single-worker pool so a crash only loses this PDF."""
+    try:
+        with ProcessPoolExecutor(max_workers=1) as ex:
+            return ex.submit(process_one, pdf_path).result()
+    except BrokenProcessPool:
+        return None, None, {"pdf_file": pdf_path.name, "error": "worker process crashed"}
+
+
+def iter_results(pdf_files: list, workers: int, chunksize: int = 4):
+    """Yield (pdf_path, process_one result) in input order."""
+    pending = list(pdf_files)
+    while pending:
+        done = 0
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                for pdf_path, result in zip(pending, ex.map(process_one, pending, chunksize=chunksize)):
+                    yield pdf_path, result
+                    done += 1
+            return
+        except BrokenProcessPool:
+            # A worker died (native crash, OOM kill). The culprit is most likely in the first chunks
+            # still owed: run those one PDF per process (still in parallel), the rest in a fresh pool.
+            # If the culprit was further back, the fresh pool breaks again and the loop repeats.
+            lost = pending[done:]
+            in_flight = (workers + 1) * chunksize
+            suspects, pending = lost[:in_flight], lost[in_flight:]
+            log(f"Worker pool crashed; isolating {len(suspects)} PDFs, resubmitting {len(pending)}")
+            with ThreadPoolExecutor(max_workers=workers) as tx:
+                yield from zip(suspects, tx.map(process_isolated, suspects))
+
+
 def main():
-    # reset log each run
-    LOG_FILE.write_text("", encoding="utf-8")
+    global _LOG_FH
+    # reset log each run; line-buffered so the file stays current without reopening it
+    _LOG_FH = open(LOG_FILE, "w", encoding="utf-8", buffering=1)
+    atexit.register(_LOG_FH.close)
 
     pdf_files = sorted(PDF_DIR.glob("*.pdf"))[:100]
     if not pdf_files:
@@ -161,36 +274,57 @@ def main():
 
     log(f"Found {len(pdf_files)} PDFs. Starting batch extraction...")
 
-    accounts = []
+    accounts = defaultdict(list)  # column-wise, one list per ACCOUNT_COLUMNS entry
     txns_list = []
     failed = []
 
-    for i, pdf_path in enumerate(pdf_files, start=1):
-        log(f"START {i}/{len(pdf_files)} -> {pdf_path.name}")
+    workers = min(os.cpu_count() or 1, 8)
+    log(f"Using {workers} worker processes")
 
-        try:
-            acc = extract_account_info(pdf_path)
-            accounts.append(acc)
+    # Workers only parse; all logging and file writes stay in this process.
+    for i, (pdf_path, (acc, txns, err)) in enumerate(iter_results(pdf_files, workers), start=1):
+        if acc is not None:
+            for k in ACCOUNT_COLUMNS:
+                accounts[k].append(acc.get(k))
+        if txns is not None and not txns.empty:
+            txns_list.append(txns)
 
-            txns = extract_transactions(pdf_path)
-            if not txns.empty:
-                txns.insert(0, "pdf_file", pdf_path.name)
-                txns.insert(1, "account_number", acc.get("account_number"))
-                txns_list.append(txns)
-
-            log(f"DONE  {i}/{len(pdf_files)} -> rows={len(txns)}")
-
-        except Exception as e:
-            failed.append({"pdf_file": pdf_path.name, "error": str(e)})
-            log(f"FAIL  {i}/{len(pdf_files)} -> {pdf_path.name} | {e}")
+        if err is None:
+            log(f"DONE  {i}/{len(pdf_files)} -> {pdf_path.name} | rows={len(txns)}")
+        else:
+            failed.append(err)
+            log(f"FAIL  {i}/{len(pdf_files)} -> {pdf_path.name} | {err['error']}")
 
     accounts_df = pd.DataFrame(accounts)
     txns_df = pd.concat(txns_list, ignore_index=True) if txns_list else pd.DataFrame()
 
+    # Derived columns are computed once here instead of on every dashboard rerun
+    txn_dates = None
+    if "txn_date" in txns_df.columns:
+        txn_dates = pd.to_datetime(txns_df["txn_date"], errors="coerce", dayfirst=True)
+        txns_df["month"] = txn_dates.dt.to_period("M").astype(str)
+    if "narration" in txns_df.columns:
+        txns_df["category"] = pd.Categorical(
+            categorize(txns_df["narration"]),
+            categories=[name for name, _ in CATEGORY_RULES] + ["Others"],
+        )
+
     accounts_df.to_csv(OUT_DIR / "accounts_all.csv", index=False)
     txns_df.to_csv(OUT_DIR / "transactions_all.csv", index=False)
 
-    log("DONE ✅ Saved output/accounts_all.csv and output/transactions_all.csv")
+    # Parquet copies keep parsed dtypes so the dashboard doesn't re-parse text;
+    # amounts stay float64 (float32 can't hold paise exactly above ~1.6 lakh)
+    typed = {}
+    if txn_dates is not None:
+        typed["txn_date"] = txn_dates
+    # Written after the CSVs: the dashboard only trusts Parquet at least as new as the CSVs
+    try:
+        accounts_df.to_parquet(OUT_DIR / "accounts_all.parquet", compression="zstd", index=False)
+        txns_df.assign(**typed).to_parquet(OUT_DIR / "transactions_all.parquet", compression="zstd", index=False)
+        log("DONE ✅ Saved output/accounts_all.csv and output/transactions_all.csv (+ .parquet)")
+    except Exception as e:
+        log("DONE ✅ Saved output/accounts_all.csv and output/transactions_all.csv")
+        log(f"Parquet not written ({e}); dashboard will read the CSVs")
     log(f"Accounts rows: {len(accounts_df)} | Transactions rows: {len(txns_df)}")
 
     if failed: